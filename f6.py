@@ -1,26 +1,177 @@
 #!/usr/bin/env python3
 
 import requests
+from requests.adapters import HTTPAdapter
 import serial
-from gpiozero import OutputDevice, InputDevice
+from gpiozero import OutputDevice, DigitalInputDevice
 from time import sleep
-from flask import Flask, render_template_string, Response, jsonify, redirect, request, send_file
+from flask import Flask, Response, redirect, request, send_file
 import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import functools
+from collections import deque
+import queue
+import time
+import asyncio
+import signal
+from urllib.parse import parse_qs
 from datetime import datetime
 import json
+import zlib
 import cv2
 import face_recognition
+import dlib
+import warnings
 import numpy as np
 import os
 import certifi
 import glob
+import fnmatch
+
+# Optional Edge TPU support for face detection
+try:
+    from pycoral.adapters import common, detect
+    from pycoral.utils import edgetpu
+except ImportError:
+    edgetpu = None
+
+# Optional filesystem watcher for captured images
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# Optional ASGI server so SSE clients are coroutines instead of one thread each
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+except ImportError:
+    serve = None
+
+# Optional pigpio daemon for hardware-timed motor stepping
+try:
+    import pigpio
+except ImportError:
+    pigpio = None
+
+# Optional KD-tree for nearest-reference search
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# face_recognition is only as fast as the dlib build under it (see setup.sh)
+dlib_avx = getattr(dlib, 'USE_AVX_INSTRUCTIONS', None)
+dlib_neon = getattr(dlib, 'USE_NEON_INSTRUCTIONS', None)
+print(f"dlib CUDA: {dlib.DLIB_USE_CUDA}, AVX: {dlib_avx}, NEON: {dlib_neon}")
+if not dlib.DLIB_USE_CUDA and dlib_avx is False and dlib_neon is False:
+    warnings.warn("dlib was built without CUDA, AVX or NEON - face encoding will be very slow; rebuild it with setup.sh")
+
+# Directory for reference face images (Desktop as database)
+REFERENCE_IMAGE_DIR = "/home/mrd/Desktop"
+if not os.path.exists(REFERENCE_IMAGE_DIR):
+    print(f"Error: Desktop directory {REFERENCE_IMAGE_DIR} not found. Exiting.")
+    exit()
+
+# Load all reference face images
+reference_encodings = []
+reference_image_paths = glob.glob(os.path.join(REFERENCE_IMAGE_DIR, "owner_face*.png"))
+if not reference_image_paths:
+    print(f"Error: No reference images found in {REFERENCE_IMAGE_DIR}")
+    exit()
+
+print(f"Found {len(reference_image_paths)} reference images")
+
+# Encodings are cached next to the images and reused while a file's mtime is unchanged
+REFERENCE_CACHE = os.path.join(REFERENCE_IMAGE_DIR, "refs.npz")
+
+def encode_reference(image_path):
+    try:
+        image = face_recognition.load_image_file(image_path)
+        encodings = face_recognition.face_encodings(image)
+        if encodings:
+            print(f"Loaded reference face from {image_path}")
+            return encodings[0]
+    except Exception as e:
+        print(f"Error loading {image_path}: {e}")
+    return None
+
+cached_encodings = {}
+if os.path.exists(REFERENCE_CACHE):
+    try:
+        with np.load(REFERENCE_CACHE) as cache:
+            for path, mtime, encoding in zip(cache["paths"], cache["mtimes"], cache["matrix"]):
+                cached_encodings[(str(path), float(mtime))] = encoding
+    except Exception as e:
+        print(f"Ignoring unreadable encoding cache {REFERENCE_CACHE}: {e}")
+
+image_mtimes = {path: os.path.getmtime(path) for path in reference_image_paths}
+uncached_paths = [path for path in reference_image_paths if (path, image_mtimes[path]) not in cached_encodings]
+cache_stale = bool(uncached_paths)
+new_encodings = {}
+if uncached_paths:
+    # Encode in parallel across cores. fork so workers don't re-run this script; this runs before
+    # any GPIO, pigpio or camera handle is opened, so the children have none to inherit
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("fork")) as executor:
+        new_encodings = dict(zip(uncached_paths, executor.map(encode_reference, uncached_paths, chunksize=8)))
+
+reference_mtimes = []
+for image_path in reference_image_paths:
+    mtime = image_mtimes[image_path]
+    encoding = cached_encodings.get((image_path, mtime))
+    if encoding is None:
+        encoding = new_encodings[image_path]
+    if encoding is not None:
+        reference_encodings.append((image_path, encoding))
+        reference_mtimes.append(mtime)
+
+if not reference_encodings:
+    print("Error: No valid face encodings found")
+    exit()
+
+# Stack reference encodings so all of them are compared in one pass
+# (stored as float16 to halve memory; distances are computed in float32)
+REF_PATHS = [path for path, _ in reference_encodings]
+REF_MATRIX = np.array([encoding for _, encoding in reference_encodings], dtype=np.float16)
+
+if cache_stale or len(cached_encodings) != len(REF_PATHS):
+    try:
+        np.savez(REFERENCE_CACHE, paths=np.array(REF_PATHS), mtimes=np.array(reference_mtimes), matrix=REF_MATRIX)
+        print(f"Saved {len(REF_PATHS)} reference encodings to {REFERENCE_CACHE}")
+    except Exception as e:
+        print(f"Error saving encoding cache: {e}")
+
+# int8 copy of the references for the full scan (a quarter of the float32 bytes);
+# the float16 rows are only used to re-check the closest few candidates
+REF_SCALE = float(np.abs(REF_MATRIX).max()) / 127 or 1.0
+REF_QUANTIZED = np.round(REF_MATRIX.astype(np.float32) / REF_SCALE).astype(np.int8)
+RERANK_CANDIDATES = 4
+
+# Distance above which a face never counts as a match
+MATCH_TOLERANCE = 0.4
+
+# Browsers only speak HTTP/2 over TLS, so hypercorn switches to h2 when these exist
+TLS_CERT_FILE = "/home/mrd/cert.pem"
+TLS_KEY_FILE = "/home/mrd/key.pem"
+USE_TLS = serve is not None and os.path.exists(TLS_CERT_FILE) and os.path.exists(TLS_KEY_FILE)
+
+# Address the owner reaches the dashboard on; the scheme follows whether port 5000 speaks TLS
+PUBLIC_URL = f"{'https' if USE_TLS else 'http'}://192.168.10.86:5000"
+
+# With a KD-tree, a query bounded by MATCH_TOLERANCE only visits nearby references
+REF_TREE = cKDTree(REF_MATRIX.astype(np.float32)) if cKDTree is not None else None
 
 # Pin Definitions
 IN1 = OutputDevice(14)  # Connect to motor IN1
 IN2 = OutputDevice(15)  # Connect to motor IN2
 IN3 = OutputDevice(18)  # Connect to motor IN3
 IN4 = OutputDevice(23)  # Connect to motor IN4
-IR_SENSOR = InputDevice(17)  # IR sensor on GPIO 17
+IR_SENSOR = DigitalInputDevice(17)  # IR sensor on GPIO 17
 
 # Step sequence for a 4-phase stepper motor
 step_sequence = [
@@ -34,84 +185,323 @@ step_sequence = [
     [1, 0, 0, 1]   # Activate IN4 + IN1
 ]
 
+# Bank 1 set/clear masks for each step, used to build the pigpio waveform
+MOTOR_PINS = [14, 15, 18, 23]
+STEP_SET_MASKS = [sum(1 << pin for pin, on in zip(MOTOR_PINS, step) if on) for step in step_sequence]
+STEP_CLEAR_MASKS = [sum(1 << pin for pin, on in zip(MOTOR_PINS, step) if not on) for step in step_sequence]
+
+pigpio_pi = pigpio.pi() if pigpio else None
+if pigpio_pi is not None and not pigpio_pi.connected:
+    print("pigpiod not running - driving motor pins individually")
+    pigpio_pi = None
+
 # Initialize Flask web server
 app = Flask(__name__)
 
 # Global variables
 motor_running = False
+motor_stop_event = threading.Event()  # Set by stop_motor; ends a running pigpio waveform
 vehicle_stopped = True
-server_logs = ["System Ready"]
-last_log_time = datetime.now()
+MAX_SERVER_LOGS = 500  # Same as the dashboard's MAX_LOGS; nothing reads further back
+server_logs = deque([(None, "System Ready")], maxlen=MAX_SERVER_LOGS)  # (time.time() or None, message)
+log_count = 1  # Logs ever written; SSE cursors count from here since old ones drop off the deque
+log_cond = threading.Condition()  # Guards the two above; notified whenever there's something new for SSE
+last_log_time = time.monotonic()
 last_gps_location = "https://www.google.com/maps?q=27.670052333333334,85.438842"
+location_seq = 0  # Bumped whenever a location is published to SSE clients
 pending_authorization = False
 sms_sent_for_current_attempt = False
-camera_lock = threading.Lock()
+camera_lock = threading.Lock()  # Held only while the camera object is opened, swapped or released
+camera_read_lock = threading.Lock()  # Held by the grabber during read(), so the capture isn't released under it
 face_recognition_active = False  # New flag to control face recognition
-
-# Directory for reference face images (Desktop as database)
-REFERENCE_IMAGE_DIR = "/home/mrd/Desktop"
-if not os.path.exists(REFERENCE_IMAGE_DIR):
-    print(f"Error: Desktop directory {REFERENCE_IMAGE_DIR} not found. Exiting.")
-    exit()
-
-# Load all reference face images
-reference_encodings = []
-reference_image_paths = glob.glob(os.path.join(REFERENCE_IMAGE_DIR, "owner_face*.png"))
-if not reference_image_paths:
-    print(f"Error: No reference images found in {REFERENCE_IMAGE_DIR}")
-    exit()
-
-print(f"Found {len(reference_image_paths)} reference images")
-for image_path in reference_image_paths:
-    try:
-        image = face_recognition.load_image_file(image_path)
-        encodings = face_recognition.face_encodings(image)
-        if encodings:
-            reference_encodings.append((image_path, encodings[0]))
-            print(f"Loaded reference face from {image_path}")
-    except Exception as e:
-        print(f"Error loading {image_path}: {e}")
-
-if not reference_encodings:
-    print("Error: No valid face encodings found")
-    exit()
+verify_cancel = threading.Event()  # Set by stop_motor so an in-progress capture gives up right away
+
+# Set when the IR sensor is released (or when stop_motor cancels the wait)
+ir_event = threading.Event()
+IR_SENSOR.when_deactivated = ir_event.set
+
+# ASGI /stream clients waiting for news, as (event loop, asyncio.Event). They have their
+# own small lock so the event loop never waits on log_cond while another thread logs
+asgi_stream_waiters = set()
+asgi_stream_waiters_lock = threading.Lock()
+
+def notify_streams():
+    # Call with log_cond held: wakes the WSGI generators and every ASGI stream
+    log_cond.notify_all()
+    with asgi_stream_waiters_lock:
+        for loop, wake in asgi_stream_waiters:
+            loop.call_soon_threadsafe(wake.set)
+
+# Logs are stored as (timestamp, message) and only formatted when someone reads them,
+# so the motor and camera threads never pay for strftime
+
+def _log(msg):
+    global last_log_time, log_count
+    with log_cond:
+        server_logs.append((time.time(), msg))
+        log_count += 1
+        notify_streams()
+    last_log_time = time.monotonic()
+
+def log_throttled(msg):
+    # Drops the message if something was logged less than a second ago
+    if time.monotonic() - last_log_time > 1:
+        _log(msg)
+
+@functools.lru_cache(maxsize=64)
+def log_stamp(second):
+    return time.strftime('%H:%M:%S', time.localtime(second))
+
+def format_log(entry):
+    logged_at, msg = entry
+    if logged_at is None:
+        return msg
+    return f"{log_stamp(int(logged_at))} - {msg}"
+
+# Each kept log is JSON-encoded once, however many responses include it
+@functools.lru_cache(maxsize=MAX_SERVER_LOGS)
+def encoded_log(entry):
+    return json.dumps(format_log(entry))
+
+def entries_since(cursor):
+    # Returns the raw entries after cursor that are still kept, and the new cursor
+    with log_cond:
+        count = log_count
+        missing = min(count - cursor, len(server_logs))
+        if missing <= 0:
+            return [], count
+        entries = list(itertools.islice(server_logs, len(server_logs) - missing, None))
+    return entries, count
+
+def logs_since(cursor):
+    entries, count = entries_since(cursor)
+    return [format_log(entry) for entry in entries], count
+
+def logs_json_since(cursor):
+    # Like logs_since, but returns the JSON array text built from the cached lines
+    entries, count = entries_since(cursor)
+    return '[' + ','.join(map(encoded_log, entries)) + ']', count
+
+def closest_reference(captured_encoding):
+    # Returns (index, distance) of the nearest reference, or None if the
+    # KD-tree found nothing within MATCH_TOLERANCE
+    if REF_TREE is not None:
+        dist, idx = REF_TREE.query(captured_encoding, k=1, distance_upper_bound=MATCH_TOLERANCE)
+        return None if np.isinf(dist) else (int(idx), float(dist))
+
+    # Rank all references at once on the int8 copy
+    captured_quantized = np.clip(np.round(captured_encoding / REF_SCALE), -127, 127).astype(np.int16)
+    diff_quantized = REF_QUANTIZED - captured_quantized
+    sq_dists = np.einsum('ij,ij->i', diff_quantized, diff_quantized, dtype=np.int32)
+    if len(sq_dists) > RERANK_CANDIDATES:
+        candidates = np.argpartition(sq_dists, RERANK_CANDIDATES)[:RERANK_CANDIDATES]
+    else:
+        candidates = np.arange(len(sq_dists))
+
+    # Exact distances for the shortlist, so the threshold isn't affected by quantization
+    # (the subtract upcasts the float16 rows on the fly instead of copying them first)
+    diff = np.subtract(REF_MATRIX[candidates], captured_encoding.astype(np.float32), dtype=np.float32)
+    dists = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+    return int(candidates[dists.argmin()]), float(dists.min())
+
+# Keep track of captured images so web requests don't rescan the Desktop.
+# File names embed the capture timestamp, so the newest one sorts last.
+CAPTURED_IMAGE_PATTERN = "captured_face_*.jpg"
+captured_images = set(glob.glob(os.path.join(REFERENCE_IMAGE_DIR, CAPTURED_IMAGE_PATTERN)))
+captured_images_lock = threading.Lock()
+
+def is_captured_image(path):
+    return fnmatch.fnmatch(os.path.basename(path), CAPTURED_IMAGE_PATTERN)
+
+# LAST_CAPTURED_IMAGE covers the image this process just wrote, but after a restart, or once
+# that image has been deleted on authorization, lookups fall back to this set
+class CapturedImageWatcher(FileSystemEventHandler):
+    def on_created(self, event):
+        if not event.is_directory and is_captured_image(event.src_path):
+            with captured_images_lock:
+                captured_images.add(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            with captured_images_lock:
+                captured_images.discard(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        with captured_images_lock:
+            captured_images.discard(event.src_path)
+            if is_captured_image(event.dest_path):
+                captured_images.add(event.dest_path)
+
+captured_observer = None
+if Observer is not None:
+    captured_observer = Observer()
+    captured_observer.schedule(CapturedImageWatcher(), REFERENCE_IMAGE_DIR, recursive=False)
+    captured_observer.daemon = True
+    captured_observer.start()
+
+# Newest image written by capture_image_with_face, so lookups don't have to scan
+LAST_CAPTURED_IMAGE = None
+
+def get_latest_captured_image():
+    if LAST_CAPTURED_IMAGE is not None and os.path.exists(LAST_CAPTURED_IMAGE):
+        return LAST_CAPTURED_IMAGE
+    if captured_observer is None:
+        return max(glob.glob(os.path.join(REFERENCE_IMAGE_DIR, CAPTURED_IMAGE_PATTERN)),
+                   key=os.path.getctime, default=None)
+    with captured_images_lock:
+        return max(captured_images, default=None)
 
 # Initialize the camera
 camera = None
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+# Face must be centered within 20% of the frame center
+FRAME_CENTER_X = FRAME_WIDTH // 2
+FRAME_CENTER_Y = FRAME_HEIGHT // 2
+MAX_CENTER_DX = FRAME_CENTER_X // 5
+MAX_CENTER_DY = FRAME_CENTER_Y // 5
+
+def release_camera():
+    # Call with camera_lock held; waits out a read in progress first
+    if camera is not None and camera.isOpened():
+        with camera_read_lock:
+            camera.release()
 
-def initialize_camera():
+def open_camera():
+    # Call with camera_lock held
     global camera
+    release_camera()
+
+    for i in range(3):
+        camera = cv2.VideoCapture(i)
+        if camera.isOpened():
+            # MJPEG with conversion off hands us the raw JPEG, so the grabber only
+            # decodes the frames someone actually takes; one buffer avoids stale frames
+            mjpg = cv2.VideoWriter_fourcc(*'MJPG')
+            camera.set(cv2.CAP_PROP_FOURCC, mjpg)
+            camera.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+            camera.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+            camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            # Cameras that refuse MJPG fall back to YUYV, which still needs OpenCV's conversion
+            if int(camera.get(cv2.CAP_PROP_FOURCC)) == mjpg:
+                camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            print(f"Camera initialized on index {i}")
+            sleep(1)  # Warm-up time
+            return True
+    
+    print("Error: Failed to initialize camera")
+    return False
+
+def initialize_camera():
+    with camera_lock:
+        return open_camera()
+
+def ensure_camera():
+    # Reopens the camera only if it was lost
     with camera_lock:
         if camera is not None and camera.isOpened():
-            camera.release()
-        
-        for i in range(3):
-            camera = cv2.VideoCapture(i)
-            if camera.isOpened():
-                camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                print(f"Camera initialized on index {i}")
-                sleep(1)  # Warm-up time
-                return True
-        
-        print("Error: Failed to initialize camera")
-        return False
+            return True
+        return open_camera()
 
 # Initial camera setup
 if not initialize_camera():
     print("Failed to initialize camera initially")
     exit()
 
+# Background frame grabber that keeps only the newest frame
+class CameraGrabber(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self._cond = threading.Condition()
+        self._latest = None
+
+    def run(self):
+        while True:
+            # The blocking read happens outside camera_lock so nobody else queues behind it
+            with camera_lock:
+                capture = camera
+            with camera_read_lock:
+                if capture is not None and capture.isOpened():
+                    ret, frame = capture.read()
+                else:
+                    ret, frame = False, None
+            if not ret or frame is None:
+                sleep(0.1)
+                continue
+            with self._cond:
+                self._latest = frame
+                self._cond.notify_all()
+
+    def get_latest(self, timeout=0.1):
+        # Wait briefly for a new frame, then hand it out only once
+        with self._cond:
+            if self._latest is None:
+                self._cond.wait(timeout)
+            frame = self._latest
+            self._latest = None
+        # Raw MJPEG arrives as a byte buffer (a single (1, N) row on V4L2); decoded frames are (H, W, 3)
+        if frame is not None and frame.ndim != 3:
+            frame = cv2.imdecode(frame.reshape(-1), cv2.IMREAD_COLOR)
+        return frame
+
+camera_grabber = CameraGrabber()
+camera_grabber.start()
+
+# Load the Edge TPU face detector once (falls back to dlib HOG without a TPU)
+FACE_DETECTOR_MODEL = "ssd_mobilenet_v2_face_quant_postprocess_edgetpu.tflite"
+tpu_interpreter = None
+if edgetpu is not None:
+    try:
+        tpu_interpreter = edgetpu.make_interpreter(FACE_DETECTOR_MODEL)
+        tpu_interpreter.allocate_tensors()
+        print("Edge TPU face detector loaded")
+    except Exception as e:
+        print(f"Edge TPU not available, using HOG detector: {e}")
+        tpu_interpreter = None
+
+# HOG runs on a half-size frame. The smallest face we accept (150px) is ~75px there, and
+# one upsample brings it back past the ~80px window dlib's frontal HOG detector needs
+HOG_DOWNSCALE = 2
+
+def detect_faces_tflite(rgb_frame):
+    if tpu_interpreter is None:
+        small_frame = cv2.resize(rgb_frame, (0, 0), fx=1 / HOG_DOWNSCALE, fy=1 / HOG_DOWNSCALE)
+        small_locations = face_recognition.face_locations(
+            small_frame,
+            model="hog",  # More accurate than 'cnn' on Raspberry Pi
+            number_of_times_to_upsample=1  # Needed for minimum-size faces at this scale, see HOG_DOWNSCALE
+        )
+        # Scale boxes back to full-resolution coordinates
+        return [tuple(v * HOG_DOWNSCALE for v in location) for location in small_locations]
+
+    height, width = rgb_frame.shape[:2]
+    _, scale = common.set_resized_input(
+        tpu_interpreter, (width, height), lambda size: cv2.resize(rgb_frame, size))
+    tpu_interpreter.invoke()
+    faces = detect.get_objects(tpu_interpreter, score_threshold=0.5, image_scale=scale)
+
+    # Convert (xmin, ymin, xmax, ymax) boxes to (top, right, bottom, left)
+    face_locations = []
+    for face in faces:
+        box = face.bbox
+        face_locations.append((max(int(box.ymin), 0), min(int(box.xmax), width),
+                               min(int(box.ymax), height), max(int(box.xmin), 0)))
+    return face_locations
+
 # Modified image capture function to ensure fresh images
-def capture_image_with_face():
-    global last_log_time, camera
-    
+# Only images the owner has to review are written to disk
+def save_captured_image(frame):
+    global LAST_CAPTURED_IMAGE
+
     # Generate unique filename with microseconds
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    captured_image_path = os.path.join(REFERENCE_IMAGE_DIR, f"captured_face_{timestamp}.png")
+    captured_image_path = os.path.join(REFERENCE_IMAGE_DIR, f"captured_face_{timestamp}.jpg")
     
     # Remove any previous temporary images (keep only the newest)
-    temp_images = sorted(glob.glob(os.path.join(REFERENCE_IMAGE_DIR, "captured_face_*.png")))
+    temp_images = sorted(glob.glob(os.path.join(REFERENCE_IMAGE_DIR, CAPTURED_IMAGE_PATTERN)))
     for old_img in temp_images[:-1]:  # Keep only the most recent one
         try:
             os.remove(old_img)
@@ -119,209 +509,154 @@ def capture_image_with_face():
         except Exception as e:
             print(f"Error removing old image: {e}")
 
-    max_retries = 5
-    retry_count = 0
-    
-    with camera_lock:
-        if not camera.isOpened():
-            if not initialize_camera():
-                return None
-
-        while retry_count < max_retries:
-            # Clear camera buffer by reading several frames
-            for _ in range(5):
-                camera.grab()
-            
-            # Capture fresh frame
-            ret, frame = camera.retrieve()
-            if not ret or frame is None:
-                retry_count += 1
-                sleep(0.5)
-                continue
+    # Save the new image as JPEG (much faster to encode than PNG)
+    ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+    if ok:
+        with open(captured_image_path, 'wb') as f:
+            f.write(buf.tobytes())
+
+    # Verify the image was saved correctly
+    if not os.path.exists(captured_image_path):
+        print("Failed to save image properly")
+        return None
+    print(f"Saved captured image: {captured_image_path}")
+    LAST_CAPTURED_IMAGE = captured_image_path
+    return captured_image_path
+
+# Good frames collected per attempt; they are encoded together in one dlib call
+CAPTURE_CANDIDATES = 3
 
-            # Convert to RGB and detect faces
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_locations = face_recognition.face_locations(rgb_frame, model="hog")
-            
-            if not face_locations:
-                print("No face detected - please look directly at camera")
-                sleep(0.5)
-                continue
-                
-            # Save the new image
-            cv2.imwrite(captured_image_path, frame)
-            print(f"Captured new image: {captured_image_path}")
-            
-            # Verify the image was saved correctly
-            if os.path.exists(captured_image_path):
-                return captured_image_path
-            else:
-                print("Failed to save image properly")
-                
-                
 def capture_image_with_face():
     global last_log_time, camera
-    
-    # Generate unique filename with microseconds
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    captured_image_path = os.path.join(REFERENCE_IMAGE_DIR, f"captured_face_{timestamp}.png")
-    
-    # Remove any previous temporary images (keep only the newest)
-    temp_images = sorted(glob.glob(os.path.join(REFERENCE_IMAGE_DIR, "captured_face_*.png")))
-    for old_img in temp_images[:-1]:  # Keep only the most recent one
-        try:
-            os.remove(old_img)
-            print(f"Removed old temporary image: {old_img}")
-        except Exception as e:
-            print(f"Error removing old image: {e}")
 
+    candidates = []
     max_retries = 10  # Increased retries for better reliability
     retry_count = 0
     min_face_size = 150  # Minimum face size in pixels (width or height)
     min_brightness = 50  # Minimum average brightness
     
-    with camera_lock:
-        if not camera.isOpened():
-            if not initialize_camera():
-                return None
-
-        while retry_count < max_retries:
-            # Clear camera buffer by reading several frames
-            for _ in range(5):
-                camera.grab()
-            
-            # Capture fresh frame
-            ret, frame = camera.retrieve()
-            if not ret or frame is None:
-                retry_count += 1
-                sleep(0.5)
-                continue
-
-            # Check image quality - brightness
-            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            brightness = np.mean(gray_frame)
-            if brightness < min_brightness:
-                print(f"Image too dark (brightness: {brightness:.1f}) - please ensure good lighting")
-                sleep(0.5)
-                continue
+    if not ensure_camera():
+        return None
 
-            # Convert to RGB and detect faces with more accurate settings
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_locations = face_recognition.face_locations(
-                rgb_frame, 
-                model="hog",  # More accurate than 'cnn' on Raspberry Pi
-                number_of_times_to_upsample=2  # Better detection for small faces
-            )
+    while retry_count < max_retries:
+        if verify_cancel.is_set():
+            print("Face capture cancelled")
+            return None
+
+        # Take the newest frame from the grabber thread; a two second gap means the camera stalled
+        frame = camera_grabber.get_latest(timeout=2)
+        if frame is None:
+            retry_count += 1
+            continue
+
+        # Check image quality - brightness (every 8th pixel is plenty for an average,
+        # weighted like the BGR2GRAY conversion so the threshold means the same)
+        blue, green, red = cv2.mean(frame[::8, ::8])[:3]
+        brightness = 0.114 * blue + 0.587 * green + 0.299 * red
+        if brightness < min_brightness:
+            print(f"Image too dark (brightness: {brightness:.1f}) - please ensure good lighting")
+            verify_cancel.wait(0.5)
+            continue
+
+        # Convert to RGB and detect faces with more accurate settings
+        rgb_frame = np.ascontiguousarray(frame[:, :, ::-1])
+        face_locations = detect_faces_tflite(rgb_frame)
+        
+        if not face_locations:
+            print("No face detected - please look directly at camera")
+            verify_cancel.wait(0.5)
+            continue
             
-            if not face_locations:
-                print("No face detected - please look directly at camera")
-                sleep(0.5)
-                continue
-                
-            # Check face size and position
-            (top, right, bottom, left) = face_locations[0]
-            face_width = right - left
-            face_height = bottom - top
-            face_center_x = (left + right) // 2
-            face_center_y = (top + bottom) // 2
+        # Check face size and position
+        (top, right, bottom, left) = face_locations[0]
+        face_width = right - left
+        face_height = bottom - top
+        face_center_x = (left + right) // 2
+        face_center_y = (top + bottom) // 2
+        
+        # Calculate face size and position requirements
+        if (face_width < min_face_size or face_height < min_face_size):
+            print(f"Face too small (w:{face_width}, h:{face_height}) - please move closer")
+            verify_cancel.wait(0.5)
+            continue
             
-            # Calculate face size and position requirements
-            if (face_width < min_face_size or face_height < min_face_size):
-                print(f"Face too small (w:{face_width}, h:{face_height}) - please move closer")
-                sleep(0.5)
-                continue
-                
-            # Check if face is centered (within 20% of frame center)
-            frame_center_x = frame.shape[1] // 2
-            frame_center_y = frame.shape[0] // 2
-            x_offset = abs(face_center_x - frame_center_x) / frame_center_x
-            y_offset = abs(face_center_y - frame_center_y) / frame_center_y
+        # Check if face is centered (within 20% of frame center)
+        if abs(face_center_x - FRAME_CENTER_X) > MAX_CENTER_DX or abs(face_center_y - FRAME_CENTER_Y) > MAX_CENTER_DY:
+            print("Face not centered - please look straight at camera")
+            verify_cancel.wait(0.5)
+            continue
             
-            if x_offset > 0.2 or y_offset > 0.2:
-                print("Face not centered - please look straight at camera")
-                sleep(0.5)
-                continue
-                
-            # Check for multiple faces
-            if len(face_locations) > 1:
-                print("Multiple faces detected - only one person should be in frame")
-                sleep(0.5)
-                continue
-                
-            # Check for face angle (simple check using face landmarks)
-            face_landmarks = face_recognition.face_landmarks(rgb_frame, face_locations)
-            if face_landmarks:
-                chin = face_landmarks[0]['chin']
-                left_chin = chin[0]
-                right_chin = chin[16]
-                chin_width = right_chin[0] - left_chin[0]
-                
-                # Check for significant rotation
-                left_eye = face_landmarks[0]['left_eye']
-                right_eye = face_landmarks[0]['right_eye']
-                eye_angle = np.arctan2(
-                    right_eye[0][1] - left_eye[0][1],
-                    right_eye[0][0] - left_eye[0][0]
-                ) * 180 / np.pi
-                
-                if abs(eye_angle) > 15:
-                    print(f"Face rotated (angle: {eye_angle:.1f}°) - please face straight forward")
-                    sleep(0.5)
-                    continue
-
-            # Save the new image
-            cv2.imwrite(captured_image_path, frame)
-            print(f"Captured good quality image: {captured_image_path}")
-            print(f"Face size: {face_width}x{face_height}, Position: ({face_center_x},{face_center_y})")
+        # Check for multiple faces
+        if len(face_locations) > 1:
+            print("Multiple faces detected - only one person should be in frame")
+            verify_cancel.wait(0.5)
+            continue
             
-            # Verify the image was saved correctly
-            if os.path.exists(captured_image_path):
-                return captured_image_path
-            else:
-                print("Failed to save image properly")
-                retry_count += 1
+        # Check for face angle (simple check using face landmarks)
+        face_landmarks = face_recognition.face_landmarks(rgb_frame, face_locations)
+        if face_landmarks:
+            chin = face_landmarks[0]['chin']
+            left_chin = chin[0]
+            right_chin = chin[16]
+            chin_width = right_chin[0] - left_chin[0]
+            
+            # Check for significant rotation
+            left_eye = face_landmarks[0]['left_eye']
+            right_eye = face_landmarks[0]['right_eye']
+            eye_angle = np.arctan2(
+                right_eye[0][1] - left_eye[0][1],
+                right_eye[0][0] - left_eye[0][0]
+            ) * 180 / np.pi
+            
+            if abs(eye_angle) > 15:
+                print(f"Face rotated (angle: {eye_angle:.1f}°) - please face straight forward")
+                verify_cancel.wait(0.5)
+                continue
 
-        print(f"Failed to capture valid image after {max_retries} attempts")
-        return None
+        # Keep the frame in memory; it is only saved if the owner has to review it
+        print("Captured good quality image")
+        print(f"Face size: {face_width}x{face_height}, Position: ({face_center_x},{face_center_y})")
+        candidates.append((frame, rgb_frame, face_locations))
+        if len(candidates) == CAPTURE_CANDIDATES:
+            return candidates
+
+    if candidates:
+        return candidates
+
+    print(f"Failed to capture valid image after {max_retries} attempts")
+    return None
 
 # Modified face comparison function with stricter matching
-def compare_faces(captured_image_path):
+def encode_candidates(candidates):
+    # Reuse the boxes found during capture so face_encodings doesn't detect again
+    encodings = []
+    for _, rgb_frame, face_locations in candidates:
+        encodings += face_recognition.face_encodings(rgb_frame, known_face_locations=face_locations[:1], num_jitters=1)
+    return encodings
+
+def compare_faces(candidates):
     global last_log_time
     try:
-        if not os.path.exists(captured_image_path):
-            print(f"Error: Image file {captured_image_path} not found")
-            return False
-
-        # Load the captured image
-        captured_image = face_recognition.load_image_file(captured_image_path)
-        captured_encodings = face_recognition.face_encodings(captured_image, 
-                                                           num_jitters=10,  # More jitters for better accuracy
-                                                           model="large")  # Use large model
+        captured_encodings = encode_candidates(candidates)
         
         if not captured_encodings:
             print("Error: No face found in the captured image")
             return False
 
-        captured_encoding = captured_encodings[0]
+        # The closest any of the frames got to any reference
+        matches = [closest for closest in map(closest_reference, captured_encodings) if closest is not None]
+        if not matches:
+            print("No reference face within tolerance")
+            return False
+        best, best_dist = min(matches, key=lambda match: match[1])
+        confidence = (1.0 - best_dist) * 100.0
+        print(f"Closest reference: {os.path.basename(REF_PATHS[best])} (distance: {best_dist:.4f}, confidence: {confidence:.1f}%)")
         
-        # Compare with each reference image using very strict parameters
-        for image_path, ref_encoding in reference_encodings:
-            print(f"Comparing with reference: {os.path.basename(image_path)}")
-            
-            # Use very low tolerance (0.4) for strict matching
-            face_distance = face_recognition.face_distance([ref_encoding], captured_encoding)[0]
-            confidence = (1 - face_distance) * 100
-            
-            # Only consider it a match if distance is very small and confidence > 80%
-            if face_distance < 0.4 and confidence > 80:
-                print(f"Strong match found (distance: {face_distance:.4f}, confidence: {confidence:.1f}%)")
-                current_time = datetime.now()
-                new_log = f"{current_time.strftime('%H:%M:%S')} - Verified match (confidence: {confidence:.1f}%)"
-                server_logs.append(new_log)
-                last_log_time = current_time
-                return True
-            else:
-                print(f"No match (distance: {face_distance:.4f}, confidence: {confidence:.1f}%)")
+        # Use very low tolerance (0.4) for strict matching
+        if best_dist < MATCH_TOLERANCE and confidence > 80:
+            print(f"Strong match found (distance: {best_dist:.4f}, confidence: {confidence:.1f}%)")
+            _log(f"Verified match (confidence: {confidence:.1f}%)")
+            return True
 
         print("No strong matches found in reference images")
         return False
@@ -336,37 +671,75 @@ def set_step(w1, w2, w3, w4):
     IN3.value = w3
     IN4.value = w4
 
+def start_motor(delay=0.001):
+    global motor_running
+    if motor_running:
+        return
+    # Armed before the thread exists, so a Stop from here on always reaches it
+    motor_running = True
+    motor_stop_event.clear()
+    threading.Thread(target=step_motor_continuous, args=(delay,)).start()
+
 def step_motor_continuous(delay=0.1):
     global motor_running, server_logs, last_log_time
-    motor_running = True
-    current_time = datetime.now()
-    new_log = f"{current_time.strftime('%H:%M:%S')} - Vehicle started"
-    server_logs.append(new_log)
-    last_log_time = current_time
+    if motor_stop_event.is_set():
+        return
+    _log("Vehicle started")
+
+    if pigpio_pi is not None:
+        # Hand the whole step sequence to pigpio as a DMA-timed waveform that
+        # repeats in hardware, so stepping needs no Python (or GIL) at all
+        delay_us = max(1, int(delay * 1000000))
+        pulses = [pigpio.pulse(set_mask, clear_mask, delay_us)
+                  for set_mask, clear_mask in zip(STEP_SET_MASKS, STEP_CLEAR_MASKS)]
+        # wave_clear deletes every waveform, so never pull one out from under the transmitter
+        if pigpio_pi.wave_tx_busy():
+            pigpio_pi.wave_tx_stop()
+        pigpio_pi.wave_clear()
+        pigpio_pi.wave_add_generic(pulses)
+        wave_id = pigpio_pi.wave_create()
+        pigpio_pi.wave_send_repeat(wave_id)
+        motor_stop_event.wait()
+        # stop_motor already halted the wave; stopping again covers a Stop that
+        # landed before wave_send_repeat
+        pigpio_pi.wave_tx_stop()
+        pigpio_pi.wave_delete(wave_id)
+        set_step(0, 0, 0, 0)
+        return
     
+    # Steps are scheduled against absolute deadlines so sleep jitter doesn't add up
+    next_step = time.perf_counter()
     while motor_running:
         for step in step_sequence:
             if not motor_running:
                 break
             set_step(*step)
-            sleep(delay / 0.0001)
-    stop_motor()
+            next_step += delay
+            if delay < 0.001:
+                # sleep() can't hit sub-millisecond delays reliably, so spin instead
+                while time.perf_counter() < next_step:
+                    pass
+            else:
+                sleep(max(0, next_step - time.perf_counter()))
+    # A step may have been written just after stop_motor cleared the coils
+    set_step(0, 0, 0, 0)
 
 def stop_motor():
     global motor_running, vehicle_stopped, server_logs, last_log_time, face_recognition_active
     motor_running = False
+    motor_stop_event.set()
     vehicle_stopped = True
     face_recognition_active = False  # Disable face recognition when stopped
+    verify_cancel.set()
+    ir_event.set()  # Wake up any pending IR sensor wait
+    if pigpio_pi is not None:
+        # Halt the waveform first so no queued pulse re-energizes a coil after we clear them
+        pigpio_pi.wave_tx_stop()
     set_step(0, 0, 0, 0)
     
-    current_time = datetime.now()
-    new_log = f"{current_time.strftime('%H:%M:%S')} - Vehicle stopped"
-    server_logs.append(new_log)
-    last_log_time = current_time
+    _log("Vehicle stopped")
 
-    with camera_lock:
-        if not camera.isOpened():
-            initialize_camera()
+    ensure_camera()
 
 def start_vehicle_with_face():
     global motor_running, vehicle_stopped, server_logs, last_log_time, pending_authorization, sms_sent_for_current_attempt, face_recognition_active
@@ -374,57 +747,93 @@ def start_vehicle_with_face():
     if not face_recognition_active:
         return
 
-    with camera_lock:
-        if not camera.isOpened():
-            if not initialize_camera():
-                return
+    if not ensure_camera():
+        return
 
     if vehicle_stopped:
         print("Starting fresh face verification process...")
-        current_time = datetime.now()
-        new_log = f"{current_time.strftime('%H:%M:%S')} - Starting face verification"
-        server_logs.append(new_log)
-        last_log_time = current_time
+        _log("Starting face verification")
 
         # Wait for IR sensor
         print("Waiting for IR sensor (finger) detection...")
-        while IR_SENSOR.value:
-            if not face_recognition_active:
-                return
-            sleep(0.1)
+        ir_event.clear()
+        while IR_SENSOR.value and face_recognition_active:
+            ir_event.wait()
+            ir_event.clear()
+        if not face_recognition_active:
+            return
 
         # Capture fresh image
-        captured_image_path = capture_image_with_face()
-        if not captured_image_path:
+        candidates = capture_image_with_face()
+        if not candidates:
             print("Failed to capture valid image")
             return
 
         # Perform strict comparison
-        match_found = compare_faces(captured_image_path)
+        match_found = compare_faces(candidates)
+
+        # Stop may have been pressed while the faces were being compared
+        if verify_cancel.is_set() or not face_recognition_active:
+            print("Face verification cancelled")
+            return
         
         if match_found:
             print("Strict face verification passed")
-            # Delete the image after successful match
-            try:
-                os.remove(captured_image_path)
-                print(f"Deleted temporary image after match: {captured_image_path}")
-            except Exception as e:
-                print(f"Error deleting image: {e}")
-            
-            threading.Thread(target=step_motor_continuous, args=(0.001,)).start()
+            start_motor(0.001)
             vehicle_stopped = False
             send_sms()
             sms_sent_for_current_attempt = False
         else:
             print("Face verification failed - keeping image for authorization")
-            if not sms_sent_for_current_attempt:
+            captured_image_path = save_captured_image(candidates[0][0])
+            if captured_image_path and not sms_sent_for_current_attempt:
                 send_image_to_owner(captured_image_path)
                 sms_sent_for_current_attempt = True
             pending_authorization = True
-# [Rest of your existing functions (send_sms, send_image_to_owner, etc.) remain the same]
+
+# Single worker so only one face verification runs at a time
+verify_queue = queue.Queue(maxsize=1)
+
+def verify_worker():
+    while True:
+        verify_queue.get()
+        # Only cleared here, between runs, so a Start click can't un-cancel a capture in progress
+        verify_cancel.clear()
+        try:
+            start_vehicle_with_face()
+        except Exception as e:
+            print(f"Error in face verification: {e}")
+
+threading.Thread(target=verify_worker, daemon=True).start()
+
+# Shared session so SMS requests reuse the TLS connection to the gateway
+SMS_SESSION = requests.Session()
+SMS_SESSION.verify = certifi.where()
+SMS_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+# SMS are posted from a background thread so the gateway round-trip never
+# holds up starting or stopping the vehicle
+sms_queue = queue.Queue()
+
+def sms_worker():
+    while True:
+        deliver, args = sms_queue.get()
+        try:
+            deliver(*args)
+        except Exception as e:
+            print(f"Error in SMS worker: {e}")
+
+threading.Thread(target=sms_worker, daemon=True).start()
+
 def send_sms():
+    sms_queue.put((deliver_sms, ()))
+
+def send_image_to_owner(captured_image_path):
+    sms_queue.put((deliver_image_to_owner, (captured_image_path,)))
+
+def deliver_sms():
 
-    website_url = 'http://192.168.10.86:5000'
+    website_url = PUBLIC_URL
 
     message = f"""
 
@@ -444,7 +853,7 @@ def send_sms():
 
     try:
 
-        r = requests.post(
+        r = SMS_SESSION.post(
 
             "https://sms.aakashsms.com/sms/v3/send/",
 
@@ -458,7 +867,7 @@ def send_sms():
 
             },
 
-            verify=certifi.where()
+            timeout=5
 
         )
 
@@ -478,13 +887,11 @@ def send_sms():
 
 # Function to send SMS with image link
 
-def send_image_to_owner(captured_image_path):
+def deliver_image_to_owner(captured_image_path):
 
     global server_logs, last_log_time
 
-    current_time = datetime.now()
-
-    image_url = f"http://192.168.10.86:5000/captured_image"
+    image_url = f"{PUBLIC_URL}/captured_image"
 
     message = f"""
 
@@ -496,13 +903,13 @@ def send_image_to_owner(captured_image_path):
 
     Image: {image_url}
 
-    Check authorization on: http://192.168.10.86:5000
+    Check authorization on: {PUBLIC_URL}
 
     """
 
     try:
 
-        r = requests.post(
+        r = SMS_SESSION.post(
 
             "https://sms.aakashsms.com/sms/v3/send/",
 
@@ -516,7 +923,7 @@ def send_image_to_owner(captured_image_path):
 
             },
 
-            verify=certifi.where()
+            timeout=5
 
         )
 
@@ -524,31 +931,19 @@ def send_image_to_owner(captured_image_path):
 
             print("SMS with image link sent successfully!")
 
-            new_log = f"{current_time.strftime('%H:%M:%S')} - Unauthorized access detected, SMS sent to owner"
-
-            server_logs.append(new_log)
-
-            last_log_time = current_time
+            _log("Unauthorized access detected, SMS sent to owner")
 
         else:
 
             print(f"Failed to send SMS: {r.text}")
 
-            new_log = f"{current_time.strftime('%H:%M:%S')} - Failed to send SMS to owner"
-
-            server_logs.append(new_log)
-
-            last_log_time = current_time
+            _log("Failed to send SMS to owner")
 
     except Exception as e:
 
         print(f"Error sending SMS: {e}")
 
-        new_log = f"{current_time.strftime('%H:%M:%S')} - Error sending SMS: {e}"
-
-        server_logs.append(new_log)
-
-        last_log_time = current_time
+        _log(f"Error sending SMS: {e}")
 
 
 
@@ -556,21 +951,19 @@ def send_image_to_owner(captured_image_path):
 
 def get_location():
 
-    global server_logs, last_log_time, last_gps_location
+    global server_logs, last_log_time, last_gps_location, location_seq
 
     fixed_location = "https://www.google.com/maps?q=27.670052333333334,85.438842"
 
-    last_gps_location = fixed_location
+    with log_cond:
 
-    current_time = datetime.now()
+        last_gps_location = fixed_location
 
-    if (current_time - last_log_time).total_seconds() > 1:
+        location_seq += 1
 
-        new_log = f"{current_time.strftime('%H:%M:%S')} - Using fixed location: {fixed_location}"
+        notify_streams()
 
-        server_logs.append(new_log)
-
-        last_log_time = current_time
+    log_throttled(f"Using fixed location: {fixed_location}")
 
     return fixed_location
 
@@ -578,39 +971,229 @@ def get_location():
 
 # SSE Route for real-time updates
 
-def stream_logs():
+@app.route('/stream')
+def stream():
+    # The page tells us how many logs it already has (Last-Event-ID on reconnect)
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', default=log_count, type=int)
+    events = stream_logs(min(since, log_count))
+
+    use_gzip = 'gzip' in request.accept_encodings
+    if use_gzip:
+        events = gzip_stream(events)
+    return Response(events, mimetype="text/event-stream", headers=stream_headers(use_gzip))
+
+def stream_headers(use_gzip):
+    # Keep proxies from buffering the stream and gzip it when the browser allows
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'Vary': 'Accept-Encoding'}
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
+
+# Shared worker that owns the dashboard's single EventSource and fans
+# messages out to every open tab
+SSE_WORKER_JS = """
+const ports = [];
+const recent = [];
+let source = null;
+let lastId = 0;
+// Reconnect delay, doubled after each failure so a rebooting Pi isn't hammered
+let backoff = 500;
+
+function broadcast(message) {
+    ports.forEach(port => port.postMessage(message));
+}
+
+function connect() {
+    source = new EventSource('/stream?since=' + lastId);
+    source.onopen = function() {
+        backoff = 500;
+    };
+    source.onmessage = function(e) {
+        lastId = Number(e.lastEventId);
+        const message = { type: 'logs', id: lastId, data: e.data };
+        recent.push(message);
+        if (recent.length > 50) {
+            recent.shift();
+        }
+        broadcast(message);
+    };
+    source.addEventListener('location', e => broadcast({ type: 'location', data: e.data }));
+    source.onerror = function() {
+        console.error('EventSource failed, retrying in ' + backoff + ' ms');
+        source.close();
+        setTimeout(connect, backoff);
+        backoff = Math.min(backoff * 2, 60000);
+    };
+}
+
+onconnect = function(event) {
+    const port = event.ports[0];
+    ports.push(port);
+    // Replay recent logs so a new tab doesn't miss lines sent before it connected
+    recent.forEach(message => port.postMessage(message));
+    port.onmessage = function(msg) {
+        if (msg.data.type === 'close') {
+            ports.splice(ports.indexOf(port), 1);
+        } else if (msg.data.type === 'open' && !source) {
+            lastId = msg.data.since;
+            connect();
+        }
+    };
+};
+"""
+
+@app.route('/sse-worker.js')
+def sse_worker():
+    return Response(SSE_WORKER_JS, mimetype='application/javascript')
+
+def gzip_chunk(compressor, chunk):
+    # Sync-flush after every event so the browser can decode it right away
+    return compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        yield gzip_chunk(compressor, chunk)
+
+def new_stream_events(cursor, seen_location_seq):
+
+    # Returns the SSE frames a client at this cursor hasn't seen yet
+
+    events = []
+
+    current_location_seq = location_seq
+
+    if current_location_seq != seen_location_seq:
+
+        events.append(f"event: location\ndata: {json.dumps({'location': last_gps_location})}\n\n")
+
+    if log_count > cursor:
+
+        new_logs, cursor = logs_since(cursor)
+
+        # One data: line per log, so the browser hands us the lines already split
+
+        data = ''.join(f"data: {' '.join(log.splitlines())}\n" for log in new_logs)
+
+        events.append(f"id: {cursor}\n{data}\n")
+
+    return events, cursor, current_location_seq
+
+SSE_COALESCE_INTERVAL = 0.1
 
-    global server_logs, initial_logs
+# Comment frame sent on an idle stream so proxies don't drop the connection
+
+SSE_HEARTBEAT = ": ping\n\n"
 
-    initial_logs = server_logs.copy()
+SSE_HEARTBEAT_INTERVAL = 15
 
-    yield f"data: {json.dumps({'logs': server_logs})}\n\n"
+def stream_logs(cursor):
+
+    seen_location_seq = location_seq
 
     while True:
 
-        sleep(0.1)
+        # Sleep until a log or location is published instead of polling
+
+        with log_cond:
+
+            published = log_cond.wait_for(lambda: log_count > cursor or location_seq != seen_location_seq,
+
+                                          timeout=SSE_HEARTBEAT_INTERVAL)
+
+        if not published:
 
-        if len(server_logs) > len(initial_logs):
+            yield SSE_HEARTBEAT
 
-            yield f"data: {json.dumps({'logs': server_logs})}\n\n"
+            continue
 
-            initial_logs = server_logs.copy()
+        # Give a burst of logs a moment to land so it goes out as one event
+
+        sleep(SSE_COALESCE_INTERVAL)
+
+        events, cursor, seen_location_seq = new_stream_events(cursor, seen_location_seq)
+
+        yield from events
+
+# ASGI version of /stream for hypercorn: each client is a coroutine
+# instead of a thread parked in stream_logs
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def stream_asgi(scope, receive, send):
+    headers = dict(scope['headers'])
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    since = headers.get(b'last-event-id', b'').decode('latin-1') or query.get('since', [''])[0]
+    cursor = min(int(since), log_count) if since.isdigit() else log_count
+    use_gzip = b'gzip' in headers.get(b'accept-encoding', b'')
+
+    response_headers = [(b'content-type', b'text/event-stream; charset=utf-8')]
+    response_headers += [(k.lower().encode(), v.encode()) for k, v in stream_headers(use_gzip).items()]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+
+    compressor = zlib.compressobj(wbits=31)
+    seen_location_seq = location_seq
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    wake = asyncio.Event()
+    wake.set()  # Send whatever the client is behind on right away
+    loop = asyncio.get_running_loop()
+    waiter = (loop, wake)
+    with asgi_stream_waiters_lock:
+        asgi_stream_waiters.add(waiter)
+    try:
+        while True:
+            # Sleep until a log or location is published, like stream_logs, or the client leaves
+            woken = asyncio.ensure_future(wake.wait())
+            await asyncio.wait({woken, disconnected}, timeout=SSE_HEARTBEAT_INTERVAL,
+                               return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+            if disconnected.done():
+                break
+            if wake.is_set():
+                wake.clear()
+                # Give a burst of logs a moment to land so it goes out as one event
+                await asyncio.sleep(SSE_COALESCE_INTERVAL)
+                # Reading the logs takes log_cond, so do it off the event loop
+                events, cursor, seen_location_seq = await loop.run_in_executor(
+                    None, new_stream_events, cursor, seen_location_seq)
+            else:
+                events = [SSE_HEARTBEAT]
+            for event in events:
+                body = gzip_chunk(compressor, event) if use_gzip else event.encode('utf-8')
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        with asgi_stream_waiters_lock:
+            asgi_stream_waiters.discard(waiter)
+        disconnected.cancel()
+
+# The dashboard follows the logs over SSE, so the control routes only report
+# their outcome and these bodies never change
+STOPPED_BODY = json.dumps({"status": "stopped"}).encode('utf-8')
+QUEUED_BODY = json.dumps({"status": "queued"}).encode('utf-8')
+BUSY_BODY = json.dumps({"status": "busy"}).encode('utf-8')
 
 @app.route('/stop_vehicle', methods=['GET'])
 def stop_motor_web():
     global server_logs, last_log_time
     stop_motor()
-    return jsonify({"logs": server_logs})
+    return Response(STOPPED_BODY, mimetype='application/json')
 
 @app.route('/start_vehicle', methods=['GET'])
 def start_motor_web():
     global server_logs, last_log_time, face_recognition_active
     face_recognition_active = True  # Enable face recognition when start is clicked
-    threading.Thread(target=start_vehicle_with_face).start()
-    return jsonify({"logs": server_logs})
+    try:
+        verify_queue.put_nowait(True)
+    except queue.Full:
+        return Response(BUSY_BODY, status=429, mimetype='application/json')
+    return Response(QUEUED_BODY, mimetype='application/json')
 
 # [Rest of your existing Flask routes remain the same]
-@app.route('/send_location', methods=['GET'])
+@app.route('/send_location', methods=['GET', 'POST'])
 
 def send_location_web():
 
@@ -620,7 +1203,12 @@ def send_location_web():
 
     location = get_location()
 
-    return jsonify({"logs": server_logs, "location": location})
+    # The dashboard receives the location over SSE, so a POST needs no body
+    if request.method == 'POST':
+
+        return '', 204
+
+    return Response(json.dumps({"location": location}), mimetype='application/json')
 
 
 
@@ -634,25 +1222,51 @@ def redirect_to_map():
 
 
 
+# Has no template variables, so it is served as a plain string
+AUTHORIZE_PAGE = """
+            <!DOCTYPE html>
+            <html lang="en">
+            <head>
+                <meta charset="UTF-8">
+                <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                <title>Authorize Access</title>
+                <style>
+                    body { background: #1a2535; color: #fff; font-family: Arial, sans-serif; text-align: center; padding: 20px; }
+                    img { max-width: 100%; height: auto; margin: 20px 0; border: 2px solid #ff4d6d; border-radius: 5px; }
+                    .button-group { display: flex; justify-content: center; gap: 10px; margin-top: 20px; }
+                    button { padding: 10px 20px; font-size: 16px; cursor: pointer; border: none; border-radius: 5px; }
+                    #yes-btn { background: #4CAF50; color: white; }
+                    #no-btn { background: #f44336; color: white; }
+                    button:hover { opacity: 0.8; }
+                </style>
+            </head>
+            <body>
+                <h1>Unauthorized Access Attempt</h1>
+                <p>Please verify the captured image and authorize access:</p>
+                <img src="/captured_image" alt="Captured Face">
+                <form method="POST">
+                    <div class="button-group">
+                        <button type="submit" name="action" value="yes" id="yes-btn">Authorize</button>
+                        <button type="submit" name="action" value="no" id="no-btn">Deny</button>
+                    </div>
+                </form>
+            </body>
+            </html>
+        """
+
 @app.route('/authorize', methods=['GET', 'POST'])
 def authorize():
     global server_logs, last_log_time, pending_authorization, vehicle_stopped, sms_sent_for_current_attempt
 
-    current_time = datetime.now()
-    
     # Get the latest captured image
-    latest_image = max(glob.glob(os.path.join(REFERENCE_IMAGE_DIR, "captured_face_*.png")), 
-                      key=os.path.getctime, default=None)
+    latest_image = get_latest_captured_image()
 
     if request.method == 'POST':
         action = request.form.get('action')
         
         if action == 'yes':
             print("Owner authorized via web! Starting vehicle...")
-            if (current_time - last_log_time).total_seconds() > 1:
-                new_log = f"{current_time.strftime('%H:%M:%S')} - Owner authorized via web! Starting vehicle..."
-                server_logs.append(new_log)
-                last_log_time = current_time
+            log_throttled("Owner authorized via web! Starting vehicle...")
             
             # Delete the image after authorization
             if latest_image and os.path.exists(latest_image):
@@ -662,7 +1276,7 @@ def authorize():
                 except Exception as e:
                     print(f"Error deleting image: {e}")
             
-            threading.Thread(target=step_motor_continuous, args=(0.001,)).start()
+            start_motor(0.001)
             vehicle_stopped = False
             send_sms()
             pending_authorization = False
@@ -670,10 +1284,7 @@ def authorize():
             
         elif action == 'no':
             print("Owner denied access via web.")
-            if (current_time - last_log_time).total_seconds() > 1:
-                new_log = f"{current_time.strftime('%H:%M:%S')} - Owner denied access via web."
-                server_logs.append(new_log)
-                last_log_time = current_time
+            log_throttled("Owner denied access via web.")
             
             # Delete the image after denial
             if latest_image and os.path.exists(latest_image):
@@ -689,36 +1300,7 @@ def authorize():
         return redirect('/')
 
     elif pending_authorization and latest_image and os.path.exists(latest_image):
-        return render_template_string("""
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Authorize Access</title>
-                <style>
-                    body { background: #1a2535; color: #fff; font-family: Arial, sans-serif; text-align: center; padding: 20px; }
-                    img { max-width: 100%; height: auto; margin: 20px 0; border: 2px solid #ff4d6d; border-radius: 5px; }
-                    .button-group { display: flex; justify-content: center; gap: 10px; margin-top: 20px; }
-                    button { padding: 10px 20px; font-size: 16px; cursor: pointer; border: none; border-radius: 5px; }
-                    #yes-btn { background: #4CAF50; color: white; }
-                    #no-btn { background: #f44336; color: white; }
-                    button:hover { opacity: 0.8; }
-                </style>
-            </head>
-            <body>
-                <h1>Unauthorized Access Attempt</h1>
-                <p>Please verify the captured image and authorize access:</p>
-                <img src="/captured_image" alt="Captured Face">
-                <form method="POST">
-                    <div class="button-group">
-                        <button type="submit" name="action" value="yes" id="yes-btn">Authorize</button>
-                        <button type="submit" name="action" value="no" id="no-btn">Deny</button>
-                    </div>
-                </form>
-            </body>
-            </html>
-        """)
+        return AUTHORIZE_PAGE
     
     return redirect('/')
 
@@ -728,35 +1310,32 @@ def authorize():
 
 def captured_image():
 
-    latest_image = max(glob.glob(os.path.join(REFERENCE_IMAGE_DIR, "captured_face_*.png")), key=os.path.getctime, default=None)
+    latest_image = get_latest_captured_image()
 
     if latest_image and os.path.exists(latest_image):
 
-        return send_file(latest_image, mimetype='image/png')
+        return send_file(latest_image, mimetype='image/jpeg')
 
     return "No captured image available", 404
 
 
 
-@app.route('/')
-
-def index():
+# The page is the same on every request, so it is rendered once at import and gzipped up front.
+# Links are relative so they keep the page's scheme when TLS is turned on
 
-    global pending_authorization, last_log_time
+START_URL = '/start_vehicle'
 
-    start_url = 'http://192.168.10.86:5000/start_vehicle'
+STOP_URL = '/stop_vehicle'
 
-    stop_url = 'http://192.168.10.86:5000/stop_vehicle'
+LOCATION_URL = '/send_location'
 
-    location_url = 'http://192.168.10.86:5000/send_location'
+MAP_REDIRECT_URL = '/redirect_to_map'
 
-    map_redirect_url = 'http://192.168.10.86:5000/redirect_to_map'
+# Number of recent logs the dashboard fetches when it first loads
 
-    if pending_authorization:
+INITIAL_LOGS_LIMIT = 200
 
-        return redirect('/authorize')
-
-    return render_template_string("""
+INDEX_PAGE = app.jinja_env.from_string("""
 
         <!DOCTYPE html>
 
@@ -790,11 +1369,15 @@ def index():
 
                 .status-box { margin-top: 20px; padding: 15px; background: rgba(255, 255, 255, 0.05); border-radius: 10px; font-size: 0.9em; color: #a3bffa; max-height: 150px; overflow-y: auto; text-align: left; border: 1px solid rgba(255, 255, 255, 0.1); }
 
-                .status-log { margin-bottom: 10px; padding: 5px; background: rgba(255, 255, 255, 0.02); border-radius: 5px; }
+                .status-spacer { position: relative; }
+
+                .status-window { position: absolute; top: 0; left: 0; right: 0; }
 
-                .status-log.new { animation: fadeIn 1s; }
+                .status-log { height: 28px; line-height: 18px; margin-bottom: 6px; padding: 5px; background: rgba(255, 255, 255, 0.02); border-radius: 5px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
 
-                @keyframes fadeIn { from { opacity: 0; transform: translateY(10px); } to { opacity: 1; transform: translateY(0); } }
+                .status-log.new { animation: fadeIn 0.3s; will-change: opacity, transform; }
+
+                @keyframes fadeIn { from { opacity: 0; transform: translateY(-4px); } to { opacity: 1; transform: translateY(0); } }
 
                 footer { margin-top: 20px; font-size: 0.9em; color: rgba(255, 255, 255, 0.6); }
 
@@ -818,17 +1401,17 @@ def index():
 
                     <a href="{{ stop_url }}" class="control-btn" onclick="updateStatus(event, this)">Stop Vehicle</a>
 
-                    <a href="{{ location_url }}" class="control-btn" onclick="updateStatus(event, this)">View GPS Location</a>
+                    <a href="{{ location_url }}" class="control-btn" onclick="requestLocation(event, this)">View GPS Location</a>
 
                 </div>
 
                 <div class="status-box" id="status-box">
 
-                    {% for log in server_logs %}
+                    <div class="status-spacer" id="status-spacer">
 
-                        <div class="status-log">{{ log }}</div>
+                        <div class="status-window" id="status-window"></div>
 
-                    {% endfor %}
+                    </div>
 
                 </div>
 
@@ -844,47 +1427,293 @@ def index():
 
             <script>
 
-                const eventSource = new EventSource('/stream');
-
                 const statusBox = document.getElementById('status-box');
 
-                let lastLogCount = {{ server_logs|length }};
+                const statusSpacer = document.getElementById('status-spacer');
 
-                eventSource.onmessage = function(event) {
+                const statusWindow = document.getElementById('status-window');
 
-                    const data = JSON.parse(event.data);
+                // Only the visible log lines get DOM rows; the rest live in logs[]
 
-                    const currentLogCount = data.logs.length;
+                const ROW_HEIGHT = 34;
 
-                    if (currentLogCount > lastLogCount) {
+                const MAX_LOGS = 500;
 
-                        statusBox.innerHTML = '';
+                const VISIBLE_ROWS = Math.ceil(150 / ROW_HEIGHT) + 4;
 
-                        data.logs.forEach(log => {
+                const INITIAL_LOGS = {{ initial_logs }};
 
-                            const logDiv = document.createElement('div');
+                let logCursor = 0;  // Server log index we have seen up to
 
-                            logDiv.className = 'status-log' + (currentLogCount > lastLogCount ? ' new' : '');
+                let logs = [];
 
-                            logDiv.textContent = log;
+                let latestLocation = null;
 
-                            statusBox.appendChild(logDiv);
+                let newFrom = 0;
 
-                        });
+                let renderScheduled = false;
+
+                let stickToBottom = true;
+
+                // SSE messages are queued here and applied once per animation frame
+
+                let pending = [];
+
+                // Clears the .new highlight (and its will-change hint) once the fade is done
+
+                let newTimer = null;
+
+                const rowPool = [];
+
+                // Last text written to each pooled row, so unchanged rows aren't touched
+
+                const rowTexts = [];
+
+                for (let i = 0; i < VISIBLE_ROWS; i++) {
+
+                    const row = document.createElement('div');
+
+                    row.className = 'status-log';
+
+                    rowPool.push(row);
+
+                }
+
+                statusWindow.append(...rowPool);
+
+                function renderLogs() {
 
-                        lastLogCount = currentLogCount;
+                    renderScheduled = false;
+
+                    // Read once before any writes; only follow new lines if the user hasn't scrolled up
+
+                    const atBottom = statusBox.scrollHeight - statusBox.scrollTop - statusBox.clientHeight < 4;
+
+                    flushPending();
+
+                    statusSpacer.style.height = (logs.length * ROW_HEIGHT) + 'px';
+
+                    if (stickToBottom && atBottom) {
 
                         statusBox.scrollTop = statusBox.scrollHeight;
 
                     }
 
-                };
+                    stickToBottom = false;
+
+                    const start = Math.max(0, Math.min(Math.floor(statusBox.scrollTop / ROW_HEIGHT), logs.length - VISIBLE_ROWS));
+
+                    statusWindow.style.transform = 'translateY(' + (start * ROW_HEIGHT) + 'px)';
+
+                    rowPool.forEach((row, i) => {
+
+                        const index = start + i;
+
+                        const text = index < logs.length ? logs[index] : '';
+
+                        if (rowTexts[i] !== text) {
+
+                            rowTexts[i] = text;
+
+                            row.textContent = text;
+
+                        }
+
+                        row.hidden = index >= logs.length;
+
+                        row.classList.toggle('new', index >= newFrom);
+
+                    });
+
+                }
+
+                function scheduleRender() {
+
+                    if (!renderScheduled) {
+
+                        renderScheduled = true;
+
+                        requestAnimationFrame(renderLogs);
+
+                    }
+
+                }
+
+                function addLogs(newLogs) {
+
+                    newFrom = logs.length;
+
+                    logs = logs.concat(newLogs);
 
-                eventSource.onerror = function() {
+                    if (logs.length > MAX_LOGS) {
 
-                    console.error('EventSource failed');
+                        newFrom = Math.max(0, newFrom - (logs.length - MAX_LOGS));
 
-                };
+                        logs = logs.slice(-MAX_LOGS);
+
+                    }
+
+                    stickToBottom = true;
+
+                    clearTimeout(newTimer);
+
+                    newTimer = setTimeout(() => {
+
+                        newFrom = logs.length;
+
+                        scheduleRender();
+
+                    }, 300);
+
+                }
+
+                function flushPending() {
+
+                    const batch = pending;
+
+                    pending = [];
+
+                    batch.forEach(message => {
+
+                        const newLogs = message.raw.split('\\n');
+
+                        // Skip lines this tab already has (the shared stream may replay them)
+
+                        if (message.id > logCursor) {
+
+                            addLogs(newLogs.slice(Math.max(0, logCursor - (message.id - newLogs.length))));
+
+                            logCursor = message.id;
+
+                        }
+
+                    });
+
+                }
+
+                statusBox.addEventListener('scroll', scheduleRender);
+
+                scheduleRender();
+
+                function onLogsMessage(id, raw) {
+
+                    pending.push({ id: id, raw: raw });
+
+                    scheduleRender();
+
+                }
+
+                // Kept current by the SSE location event, so the GPS button never has to ask the server
+
+                function onLocationMessage(raw) {
+
+                    latestLocation = JSON.parse(raw).location;
+
+                }
+
+                // One SSE connection per browser, shared by every open tab
+
+                function openStream() {
+
+                    if (window.SharedWorker) {
+
+                        const sseWorker = new SharedWorker('/sse-worker.js');
+
+                        sseWorker.port.onmessage = function(event) {
+
+                            const message = event.data;
+
+                            if (message.type === 'logs') {
+
+                                onLogsMessage(message.id, message.data);
+
+                            } else if (message.type === 'location') {
+
+                                onLocationMessage(message.data);
+
+                            }
+
+                        };
+
+                        sseWorker.port.postMessage({ type: 'open', since: logCursor });
+
+                        window.addEventListener('pagehide', () => sseWorker.port.postMessage({ type: 'close' }));
+
+                    } else {
+
+                        let lastId = logCursor;
+
+                        let backoff = 500;
+
+                        const connect = () => {
+
+                            const eventSource = new EventSource('/stream?since=' + lastId);
+
+                            eventSource.onopen = () => { backoff = 500; };
+
+                            eventSource.onmessage = event => {
+
+                                lastId = Number(event.lastEventId);
+
+                                onLogsMessage(lastId, event.data);
+
+                            };
+
+                            eventSource.addEventListener('location', event => onLocationMessage(event.data));
+
+                            // Back off instead of letting the browser reconnect straight away
+
+                            eventSource.onerror = function() {
+
+                                console.error('EventSource failed, retrying in ' + backoff + ' ms');
+
+                                eventSource.close();
+
+                                setTimeout(connect, backoff);
+
+                                backoff = Math.min(backoff * 2, 60000);
+
+                            };
+
+                        };
+
+                        connect();
+
+                    }
+
+                }
+
+                // The page itself carries no logs; fetch a recent window, then follow the stream from there
+
+                fetch('/logs/initial?limit=' + INITIAL_LOGS, { headers: { 'Accept': 'application/json' } })
+
+                    .then(response => response.json())
+
+                    .then(data => {
+
+                        logs = data.logs;
+
+                        logCursor = data.cursor;
+
+                        newFrom = logs.length;
+
+                        latestLocation = data.location;
+
+                        stickToBottom = true;
+
+                        scheduleRender();
+
+                    })
+
+                    .catch(error => console.error('Error:', error))
+
+                    .finally(openStream);
+
+                const FETCH_INIT = { keepalive: true, headers: { 'Accept': 'application/json' } };
+
+                // Pending request per button, so a repeat click cancels the previous one
+
+                const pendingFetches = new Map();
 
                 function updateStatus(event, element) {
 
@@ -892,15 +1721,29 @@ def index():
 
                     const url = element.href;
 
-                    fetch(url)
+                    if (pendingFetches.has(element)) {
+
+                        pendingFetches.get(element).abort();
+
+                    }
+
+                    const controller = new AbortController();
+
+                    pendingFetches.set(element, controller);
+
+                    const timeout = setTimeout(() => controller.abort(), 5000);
+
+                    fetch(url, { ...FETCH_INIT, signal: controller.signal })
 
                         .then(response => response.json())
 
-                        .then(data => {
+                        .finally(() => {
+
+                            clearTimeout(timeout);
 
-                            if (data.location) {
+                            if (pendingFetches.get(element) === controller) {
 
-                                window.open(data.location, '_blank');
+                                pendingFetches.delete(element);
 
                             }
 
@@ -908,60 +1751,141 @@ def index():
 
                         .catch(error => {
 
-                            console.error('Error:', error);
+                            if (error.name === 'AbortError' && pendingFetches.has(element)) {
 
-                            const logDiv = document.createElement('div');
+                                return;  // Superseded by a newer click
 
-                            logDiv.className = 'status-log new';
+                            }
 
-                            logDiv.textContent = 'Error occurred';
+                            console.error('Error:', error);
 
-                            statusBox.appendChild(logDiv);
+                            addLogs(['Error occurred']);
 
-                            statusBox.scrollTop = statusBox.scrollHeight;
+                            scheduleRender();
 
                         });
 
                 }
 
+                function requestLocation(event, element) {
+
+                    event.preventDefault();
+
+                    // Open what the stream last sent right away (inside the click, so it isn't
+
+                    // treated as a popup) and ask the server to publish a fresh fix over SSE
+
+                    if (latestLocation) {
+
+                        window.open(latestLocation, '_blank');
+
+                    }
+
+                    fetch(element.href, { ...FETCH_INIT, method: 'POST' })
+
+                        .catch(error => console.error('Error:', error));
+
+                }
+
             </script>
 
         </body>
 
         </html>
 
-    """, start_url=start_url, stop_url=stop_url, location_url=location_url, map_redirect_url=map_redirect_url, server_logs=server_logs)
+    """).render(start_url=START_URL, stop_url=STOP_URL, location_url=LOCATION_URL, map_redirect_url=MAP_REDIRECT_URL,
+                initial_logs=INITIAL_LOGS_LIMIT)
 
+# The page is the same for every visitor, so it is compressed once at startup
 
+page_compressor = zlib.compressobj(wbits=31)
 
-from flask import send_file
+INDEX_PAGE_GZ = page_compressor.compress(INDEX_PAGE.encode('utf-8')) + page_compressor.flush()
 
 
 
-initial_logs = server_logs.copy()
+@app.route('/logs/initial')
 
-def run_flask():
+def initial_logs():
 
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    limit = min(request.args.get('limit', default=INITIAL_LOGS_LIMIT, type=int), MAX_SERVER_LOGS)
 
+    logs_json, cursor = logs_json_since(log_count - max(limit, 0))
 
+    body = '{"logs": %s, "cursor": %d, "location": %s}' % (logs_json, cursor, json.dumps(last_gps_location))
 
-flask_thread = threading.Thread(target=run_flask)
+    return Response(body, mimetype='application/json')
 
-flask_thread.daemon = True
 
-flask_thread.start()
+
+@app.route('/')
+
+def index():
+
+    global pending_authorization, last_log_time
+
+    if pending_authorization:
+
+        return redirect('/authorize')
+
+    if 'gzip' in request.accept_encodings:
+
+        return Response(INDEX_PAGE_GZ, mimetype='text/html', headers={'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+
+    return Response(INDEX_PAGE, mimetype='text/html', headers={'Vary': 'Accept-Encoding'})
+
+
+
+from flask import send_file
+
+
+
+flask_asgi = WsgiToAsgi(app) if serve else None
+async def asgi_app(scope, receive, send):
+    # /stream is served natively, everything else goes through the Flask app
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] == 'http' and scope['path'] == '/stream':
+        await stream_asgi(scope, receive, send)
+    else:
+        await flask_asgi(scope, receive, send)
+
+def run_flask():
+
+    if serve is None:
+        # One thread per request, so button clicks never queue behind an open /stream
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+        return
+
+    config = Config()
+    config.bind = ['0.0.0.0:5000']
+    if USE_TLS:
+        # The stream and every other request share one multiplexed connection
+        config.certfile = TLS_CERT_FILE
+        config.keyfile = TLS_KEY_FILE
+        config.alpn_protocols = ['h2', 'http/1.1']
+    # Runs in the main thread, so hypercorn handles SIGINT/SIGTERM and returns after a graceful shutdown
+    asyncio.run(serve(asgi_app, config))
+
 
 
 if __name__ == '__main__':
     try:
         print("System ready - waiting for start command...")
-        while True:
-            sleep(1)
+        # The web server owns the main thread; the motor, camera and SMS work
+        # already runs in daemon threads. A service stop ends the dev server like Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        run_flask()
     except KeyboardInterrupt:
-        print("Shutting down...")
+        pass
     finally:
+        print("Shutting down...")
         stop_motor()
         with camera_lock:
-            if camera.isOpened():
-                camera.release()
\ No newline at end of file
+            release_camera()
\ No newline at end of file
@@ -0,0 +1,40 @@
+#!/usr/bin/env bash
+# Rebuild dlib with the SIMD flags for this board so face_locations,
+# face_encodings and face_distance run on NEON/AVX instead of scalar code.
+#
+# Verify afterwards with:
+#   python3 -c "import dlib; print(dlib.DLIB_USE_CUDA, dlib.USE_AVX_INSTRUCTIONS, dlib.USE_NEON_INSTRUCTIONS)"
+
+set -e
+
+ARCH=$(uname -m)
+
+case "$ARCH" in
+    armv7l)
+        # Raspberry Pi 3/4 running a 32-bit OS
+        FLAGS="-O3 -mfpu=neon-fp-armv8 -mfloat-abi=hard -ftree-vectorize -funsafe-math-optimizations"
+        OPTIONS="--yes USE_NEON_INSTRUCTIONS"
+        ;;
+    aarch64)
+        # Raspberry Pi 4 running a 64-bit OS (NEON is always on)
+        FLAGS="-O3 -march=armv8-a+crc+simd"
+        OPTIONS="--yes USE_NEON_INSTRUCTIONS"
+        ;;
+    *)
+        # Desktop / x86_64
+        FLAGS="-O3 -march=native"
+        OPTIONS="--yes USE_AVX_INSTRUCTIONS"
+        ;;
+esac
+
+echo "Building dlib for $ARCH with: $FLAGS"
+
+BUILD_DIR=$(mktemp -d)
+git clone --depth 1 https://github.com/davisking/dlib.git "$BUILD_DIR/dlib"
+cd "$BUILD_DIR/dlib"
+# dlib turns CUDA on by itself when it finds the CUDA toolkit and cuDNN
+python3 setup.py install --no DLIB_GIF_SUPPORT $OPTIONS --compiler-flags "$FLAGS"
+cd -
+rm -rf "$BUILD_DIR"
+
+python3 -c "import dlib; print('CUDA:', dlib.DLIB_USE_CUDA, 'AVX:', getattr(dlib, 'USE_AVX_INSTRUCTIONS', None), 'NEON:', getattr(dlib, 'USE_NEON_INSTRUCTIONS', None))"